@@ -1,7 +1,9 @@
 import streamlit as st
-from collections import defaultdict
 import pandas as pd
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from settlements import build_summary, format_transfer, ledger_snapshot
 
 st.set_page_config(page_title="Expense Settlement", layout="centered")
 
@@ -83,15 +85,22 @@ if "participants" not in st.session_state:
     st.session_state.participants = []
 if "currency_choice" not in st.session_state:
     st.session_state.currency_choice = "USD"
+if "ledger_version" not in st.session_state:
+    # Bumped on every add/edit/delete; keys the background summary job
+    st.session_state.ledger_version = 0
 
 # --- Handle reset flags ---
 if st.session_state.get("reset_all_now", False):
+    # Stop any in-flight summary before its job is dropped with the session
+    if "summary_job" in st.session_state:
+        st.session_state.summary_job["cancel"].set()
     # Reset everything, including currency
     saved_participants = st.session_state.get("participants", [])
     st.session_state.clear()
     st.session_state.receipts = []
     st.session_state.participants = saved_participants
     st.session_state.currency_choice = "USD"
+    st.session_state.ledger_version = 0
     st.session_state.form_id = 0
     st.session_state.num_items = 1
     st.session_state.reset_all_now = False
@@ -428,6 +437,7 @@ if submitted:
                 "tax_foreign": tax_foreign,
                 "tip_foreign": tip_foreign,
             }
+            st.session_state.ledger_version += 1
             st.success("✅ Changes saved!")
         else:
             st.session_state.receipts.append({
@@ -438,6 +448,7 @@ if submitted:
                 "tax_foreign": tax_foreign,
                 "tip_foreign": tip_foreign,
             })
+            st.session_state.ledger_version += 1
             st.success("✅ Receipt added!")
 
         # Clear some temporary fields
@@ -449,57 +460,43 @@ if submitted:
         st.rerun()
 
 # -----------------------
-# Settlement calculation
+# Background summary computation
 # -----------------------
-def calculate_settlements(receipts):
-    balances = defaultdict(float)
-    total_paid = defaultdict(float)
-    total_owed = defaultdict(float)
-
-    for receipt in receipts:
-        payer = receipt["payer"]
-        tax = receipt["tax"]
-        tip = receipt["tip"]
-        items = receipt["items"]
-
-        total_item_cost = sum(item["price_usd"] for item in items)
-        if total_item_cost == 0:
-            continue
-
-        for item in items:
-            ratio = item["price_usd"] / total_item_cost
-            item["price_with_tax_tip"] = item["price_usd"] + ratio * tax + ratio * tip
-
-        for item in items:
-            if item["shared_with"]:
-                split = round(item["price_with_tax_tip"] / len(item["shared_with"]), 2)
-                for person in item["shared_with"]:
-                    total_owed[person] += split
-                    balances[person] -= split
-
-        total_paid[payer] += total_item_cost + tax + tip
-        balances[payer] += total_item_cost + tax + tip
-
-    balances = {p: round(v,2) for p,v in balances.items()}
-    total_paid = {p: round(v,2) for p,v in total_paid.items()}
-    total_owed = {p: round(v,2) for p,v in total_owed.items()}
-
-    creditors = [(p, amt) for p, amt in balances.items() if amt > 0]
-    debtors = [(p, -amt) for p, amt in balances.items() if amt < 0]
-
-    i = j = 0
-    txns = []
-    while i < len(debtors) and j < len(creditors):
-        debtor, debt = debtors[i]
-        creditor, credit = creditors[j]
-        payment = min(debt, credit)
-        txns.append(f"{debtor} pays {creditor} ${payment:.2f}")
-        debtors[i] = (debtor, debt - payment)
-        creditors[j] = (creditor, credit - payment)
-        if debtors[i][1] == 0: i += 1
-        if creditors[j][1] == 0: j += 1
-
-    return txns, total_paid, total_owed, balances
+# How long the script waits for a fresh summary before falling back to progressive results
+SUMMARY_INLINE_WAIT = 0.1
+
+@st.cache_resource
+def get_summary_pool():
+    # One worker shared across sessions: the computation is pure Python and holds the GIL,
+    # so extra threads would only compete with each other and with the script threads
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+
+def cancel_summary():
+    job = st.session_state.pop("summary_job", None)
+    if job is not None:
+        job["cancel"].set()
+        job["future"].cancel()
+    st.session_state.pop("summary_result", None)
+
+def submit_summary(receipts):
+    key = st.session_state.ledger_version
+    job = st.session_state.get("summary_job")
+    if job is not None and job["key"] == key:
+        return job
+
+    # Ledger changed: cancel the outdated run before starting a fresh one
+    if job is not None:
+        job["cancel"].set()
+        job["future"].cancel()
+    cancel_event = threading.Event()
+    job = {
+        "key": key,
+        "cancel": cancel_event,
+        # Snapshot once per ledger change, so the worker never touches session state
+        "future": get_summary_pool().submit(build_summary, ledger_snapshot(receipts), cancel_event),
+    }
+    st.session_state.summary_job = job
+    return job
 
 # -----------------------
 # Display receipts + summary
@@ -638,6 +635,7 @@ if st.session_state.receipts:
         with col2:
             if st.button("🗑 Delete", key=f"delete_{idx}"):
                 st.session_state.receipts.pop(idx)
+                st.session_state.ledger_version += 1
                 st.rerun()
         with col3:
             if st.button("✏️ Edit", key=f"edit_{idx}"):
@@ -647,45 +645,82 @@ if st.session_state.receipts:
                 st.rerun()
 
 
-    st.subheader("📊 Per-Person Summary")
+    summary_job = submit_summary(st.session_state.receipts)
+    # Typical ledgers finish within the wait and render right away, without polling
+    done, _ = wait([summary_job["future"]], timeout=SUMMARY_INLINE_WAIT)
+    summary_pending = not done
+
+    # Polls only while a slow job is running; the rest of the page stays interactive meanwhile
+    @st.fragment(run_every=0.5 if summary_pending else None)
+    def render_summary():
+        job = st.session_state.summary_job
+        result = st.session_state.get("summary_result")
+        if job["future"].done() and (result is None or result["key"] != job["key"]):
+            result = {**job["future"].result(), "key": job["key"]}
+            st.session_state.summary_result = result
+            if summary_pending:
+                # Full rerun so the fragment stops polling
+                st.rerun()
+        stale = result is not None and result["key"] != job["key"]
+
+        st.subheader("📊 Per-Person Summary")
     
-    st.markdown(
-        f"""
-        <div style="display:flex; align-items:center; gap:8px; color:blue; margin-left:13px;">
-            <img src="data:image/png;base64,{icon_base64}" width="15">
-            <span style="font-size:12px;"><i>Amounts are shown in USD.</i></span>
-        </div>
-        """, unsafe_allow_html=True
-    )
+        st.markdown(
+            f"""
+            <div style="display:flex; align-items:center; gap:8px; color:blue; margin-left:13px;">
+                <img src="data:image/png;base64,{icon_base64}" width="15">
+                <span style="font-size:12px;"><i>Amounts are shown in USD.</i></span>
+            </div>
+            """, unsafe_allow_html=True
+        )
     
-    settlements, total_paid, total_owed, balances = calculate_settlements(st.session_state.receipts)
-    people = sorted(set(list(total_paid.keys()) + list(total_owed.keys())))
-    df = pd.DataFrame([{
-        "Name": p,
-        "Paid": total_paid.get(p,0),
-        "Owes": total_owed.get(p,0),
-        "Net Balance": balances.get(p,0)
-    } for p in people])
-    def highlight_net(v):
-        return "color: green; font-weight:bold;" if v>0 else ("color: red; font-weight:bold;" if v<0 else "")
-    st.dataframe(df.style.applymap(highlight_net, subset=["Net Balance"])
-                 .format({"Paid":"${:.2f}","Owes":"${:.2f}","Net Balance":"${:.2f}"}), use_container_width=True)
-
-    st.subheader("💸 Settlement Summary")
+        if result is None:
+            st.info("⏳ Calculating summary...")
+            return
+        if stale:
+            st.warning("⏳ Showing the last calculated results while the summary updates...")
+
+        settlements, df = result["settlements"], result["df"]
+        def highlight_net(v):
+            return "color: green; font-weight:bold;" if v>0 else ("color: red; font-weight:bold;" if v<0 else "")
+        st.dataframe(df.style.applymap(highlight_net, subset=["Net Balance"])
+                     .format({"Paid":"${:.2f}","Owes":"${:.2f}","Net Balance":"${:.2f}"}), use_container_width=True)
+
+        st.subheader("💸 Settlement Summary")
     
-    st.markdown(
-        f"""
-        <div style="display:flex; align-items:center; gap:8px; color:blue; margin-left:13px;">
-            <img src="data:image/png;base64,{icon_base64}" width="15">
-            <span style="font-size:12px;"><i>Amounts are shown in USD.</i></span>
-        </div>
-        """, unsafe_allow_html=True
-    )
+        st.markdown(
+            f"""
+            <div style="display:flex; align-items:center; gap:8px; color:blue; margin-left:13px;">
+                <img src="data:image/png;base64,{icon_base64}" width="15">
+                <span style="font-size:12px;"><i>Amounts are shown in USD.</i></span>
+            </div>
+            """, unsafe_allow_html=True
+        )
     
-    if settlements:
-        for s in settlements:
-            st.success(s)
-    else:
-        st.info("Everyone is settled. No payments needed.")
+        def flows_table(flows):
+            rows = []
+            for f in flows:
+                if f["receipt"] is None:
+                    row = {"Receipt": "—", "Item": "Offset via netting"}
+                elif stale:
+                    # Positions belong to the old ledger and may have shifted; show the name only
+                    row = {"Receipt": "—", "Item": f["item"]}
+                else:
+                    row = {"Receipt": f"#{f['receipt']+1}", "Item": f"#{f['item_index']+1} {f['item']}"}
+                rows.append({**row, "Amount": f["amount"]})
+            return pd.DataFrame(rows)
+
+        if settlements:
+            for s in settlements:
+                st.success(format_transfer(s))
+                if s["flows"]:
+                    with st.expander("Contributing items"):
+                        st.dataframe(flows_table(s["flows"]).style.format({"Amount":"${:.2f}"}),
+                                     hide_index=True, use_container_width=True)
+        else:
+            st.info("Everyone is settled. No payments needed.")
+
+    render_summary()
 else:
+    cancel_summary()
     st.info("No receipts added yet.")
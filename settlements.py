@@ -0,0 +1,135 @@
+from collections import defaultdict
+import pandas as pd
+
+NETTING_FLOW = "offset via netting"
+
+# -----------------------
+# Settlement calculation
+# -----------------------
+class SummaryCancelled(Exception):
+    pass
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise SummaryCancelled()
+
+def calculate_settlements(receipts, cancel_event=None):
+    # All money is tracked in integer cents so flows add up exactly to their transfer
+    balances = defaultdict(int)
+    total_paid = defaultdict(int)
+    total_owed = defaultdict(int)
+    # shares[debtor][creditor]: debtor's item shares on receipts paid by creditor, in ledger order
+    shares = defaultdict(lambda: defaultdict(list))
+
+    for r_idx, receipt in enumerate(receipts):
+        _check_cancelled(cancel_event)
+        payer = receipt["payer"]
+        tax = receipt["tax"]
+        tip = receipt["tip"]
+        items = receipt["items"]
+
+        total_item_cost = sum(item["price_usd"] for item in items)
+        if total_item_cost == 0:
+            continue
+
+        for item in items:
+            ratio = item["price_usd"] / total_item_cost
+            item["price_with_tax_tip"] = item["price_usd"] + ratio * tax + ratio * tip
+
+        for i_idx, item in enumerate(items):
+            if item["shared_with"]:
+                split = round(item["price_with_tax_tip"] * 100 / len(item["shared_with"]))
+                for person in item["shared_with"]:
+                    total_owed[person] += split
+                    balances[person] -= split
+                    if person != payer:
+                        shares[person][payer].append({
+                            "receipt": r_idx,
+                            "item_index": i_idx,
+                            "item": item["name"],
+                            "amount": split,
+                        })
+
+        receipt_total = round((total_item_cost + tax + tip) * 100)
+        total_paid[payer] += receipt_total
+        balances[payer] += receipt_total
+
+    creditors = [(p, amt) for p, amt in balances.items() if amt > 0]
+    debtors = [(p, -amt) for p, amt in balances.items() if amt < 0]
+
+    def allocate(debtor, creditor, amount):
+        # The greedy matching below meets each (debtor, creditor) pair at most once,
+        # so every share list is walked at most once: linear in the number of items.
+        flows = []
+        for share in shares[debtor][creditor]:
+            if amount == 0:
+                break
+            take = min(share["amount"], amount)
+            flows.append({**share, "amount": take})
+            amount -= take
+        if amount > 0:
+            # No direct item link left between these two; the rest comes from balance netting
+            flows.append({"receipt": None, "item_index": None, "item": NETTING_FLOW, "amount": amount})
+        return flows
+
+    i = j = 0
+    txns = []
+    while i < len(debtors) and j < len(creditors):
+        _check_cancelled(cancel_event)
+        debtor, debt = debtors[i]
+        creditor, credit = creditors[j]
+        payment = min(debt, credit)
+        txns.append({
+            "payer": debtor,
+            "payee": creditor,
+            "amount": payment / 100,
+            "currency": "USD",
+            "flows": [{**f, "amount": f["amount"] / 100} for f in allocate(debtor, creditor, payment)],
+        })
+        debtors[i] = (debtor, debt - payment)
+        creditors[j] = (creditor, credit - payment)
+        if debtors[i][1] == 0: i += 1
+        if creditors[j][1] == 0: j += 1
+
+    balances = {p: v / 100 for p,v in balances.items()}
+    total_paid = {p: v / 100 for p,v in total_paid.items()}
+    total_owed = {p: v / 100 for p,v in total_owed.items()}
+
+    return txns, total_paid, total_owed, balances
+
+def format_transfer(txn):
+    return f"{txn['payer']} pays {txn['payee']} ${txn['amount']:.2f}"
+
+# -----------------------
+# Background summary computation
+# -----------------------
+def ledger_snapshot(receipts):
+    # Only the fields that affect settlements; display-only keys are left out
+    return tuple(
+        (r["payer"], r["tax"], r["tip"],
+         tuple((it["name"], it["price_usd"], tuple(it["shared_with"])) for it in r["items"]))
+        for r in receipts
+    )
+
+def receipts_from_snapshot(snapshot):
+    return [{
+        "payer": payer,
+        "tax": tax,
+        "tip": tip,
+        "items": [{"name": n, "price_usd": price, "shared_with": list(shared)} for n, price, shared in items],
+    } for payer, tax, tip, items in snapshot]
+
+def build_summary(snapshot, cancel_event):
+    # Runs on a worker thread: works on its own copy of the ledger and never calls st.*
+    receipts = receipts_from_snapshot(snapshot)
+
+    settlements, total_paid, total_owed, balances = calculate_settlements(receipts, cancel_event)
+    _check_cancelled(cancel_event)
+    people = sorted(set(list(total_paid.keys()) + list(total_owed.keys())))
+    df = pd.DataFrame([{
+        "Name": p,
+        "Paid": total_paid.get(p,0),
+        "Owes": total_owed.get(p,0),
+        "Net Balance": balances.get(p,0)
+    } for p in people])
+    return {"settlements": settlements, "df": df}
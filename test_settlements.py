@@ -0,0 +1,150 @@
+import threading
+
+import pytest
+
+import settlements
+from settlements import (
+    NETTING_FLOW,
+    SummaryCancelled,
+    build_summary,
+    calculate_settlements,
+    format_transfer,
+    ledger_snapshot,
+    receipts_from_snapshot,
+)
+
+
+def receipt(payer, items, tax=0.0, tip=0.0):
+    return {
+        "payer": payer,
+        "tax": tax,
+        "tip": tip,
+        "items": [{"name": n, "price_usd": p, "shared_with": s} for n, p, s in items],
+    }
+
+
+def cents(x):
+    return round(x * 100)
+
+
+def test_transfer_shape():
+    txns, total_paid, total_owed, balances = calculate_settlements([
+        receipt("A", [("dinner", 30.0, ["A", "B", "C"])]),
+    ])
+    assert [(t["payer"], t["payee"], t["amount"], t["currency"]) for t in txns] == [
+        ("B", "A", 10.0, "USD"),
+        ("C", "A", 10.0, "USD"),
+    ]
+    assert format_transfer(txns[0]) == "B pays A $10.00"
+    assert total_paid == {"A": 30.0}
+    assert balances == {"A": 20.0, "B": -10.0, "C": -10.0}
+
+
+def test_flows_point_at_receipts_paid_by_payee():
+    receipts = [
+        receipt("A", [("coffee", 10.0, ["A"])]),
+        receipt("C", [("pizza", 10.0, ["B"])]),
+        receipt("A", [("taxi", 10.0, ["B"])]),
+    ]
+    txns, *_ = calculate_settlements(receipts)
+    by_payee = {t["payee"]: t for t in txns}
+    assert by_payee["A"]["flows"] == [{"receipt": 2, "item_index": 0, "item": "taxi", "amount": 10.0}]
+    assert by_payee["C"]["flows"] == [{"receipt": 1, "item_index": 0, "item": "pizza", "amount": 10.0}]
+    for t in txns:
+        for f in t["flows"]:
+            assert receipts[f["receipt"]]["payer"] == t["payee"]
+
+
+def test_same_named_items_keep_their_position():
+    txns, *_ = calculate_settlements([
+        receipt("A", [("beer", 10.0, ["B"]), ("beer", 5.0, ["A", "B"])]),
+    ])
+    assert txns[0]["flows"] == [
+        {"receipt": 0, "item_index": 0, "item": "beer", "amount": 10.0},
+        {"receipt": 0, "item_index": 1, "item": "beer", "amount": 2.5},
+    ]
+
+
+def test_unlinked_transfer_is_offset_via_netting():
+    txns, *_ = calculate_settlements([
+        receipt("A", [("hotel", 30.0, ["B"])]),
+        receipt("B", [("train", 30.0, ["C"])]),
+    ])
+    assert len(txns) == 1
+    assert (txns[0]["payer"], txns[0]["payee"]) == ("C", "A")
+    assert txns[0]["flows"] == [{"receipt": None, "item_index": None, "item": NETTING_FLOW, "amount": 30.0}]
+
+
+def test_flows_sum_exactly_to_amount_and_shares():
+    receipts = [
+        receipt("A", [("x", 10.0, ["A", "B", "C"]), ("z", 3.0, ["B"])], tax=1.37, tip=2.11),
+        receipt("C", [("y", 7.77, ["A", "B", "C"])], tax=0.55),
+    ]
+    # Each person's share of an item, tax and tip included, in cents
+    expected = {
+        (0, 0): round((10.0 + 10.0 / 13.0 * 3.48) * 100 / 3),
+        (0, 1): round((3.0 + 3.0 / 13.0 * 3.48) * 100),
+        (1, 0): round((7.77 + 0.55) * 100 / 3),
+    }
+    txns, *_ = calculate_settlements(receipts)
+    assert txns
+    used = {}
+    for t in txns:
+        assert sum(cents(f["amount"]) for f in t["flows"]) == cents(t["amount"])
+        for f in t["flows"]:
+            if f["receipt"] is not None:
+                key = (t["payer"], f["receipt"], f["item_index"])
+                used[key] = used.get(key, 0) + cents(f["amount"])
+    for (debtor, r_idx, i_idx), amount in used.items():
+        assert amount <= expected[(r_idx, i_idx)]
+    z = next(f for t in txns for f in t["flows"] if f["item"] == "z")
+    assert cents(z["amount"]) == expected[(0, 1)]
+
+
+def test_cancelled_run_raises():
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(SummaryCancelled):
+        calculate_settlements([receipt("A", [("x", 1.0, ["B"])])], cancel_event)
+
+
+def test_snapshot_round_trip():
+    snapshot = ledger_snapshot([
+        receipt("A", [("beer", 10.0, ["A", "B"]), ("beer", 5.0, ["B"])], tax=1.0, tip=2.0),
+        receipt("B", [("taxi", 12.0, ["A"])]),
+    ])
+    assert ledger_snapshot(receipts_from_snapshot(snapshot)) == snapshot
+    hash(snapshot)
+
+
+def test_snapshot_ignores_display_only_keys():
+    r = receipt("A", [("x", 10.0, ["A", "B"])], tax=1.0)
+    before = ledger_snapshot([r])
+    r["tax_foreign"] = 150.0
+    r["items"][0]["price_foreign_display"] = 1500.0
+    r["items"][0]["price_with_tax_tip"] = 11.0
+    assert ledger_snapshot([r]) == before
+
+
+def test_build_summary():
+    summary = build_summary(ledger_snapshot([receipt("A", [("x", 30.0, ["A", "B", "C"])])]), threading.Event())
+    assert [format_transfer(t) for t in summary["settlements"]] == ["B pays A $10.00", "C pays A $10.00"]
+    assert summary["df"].to_dict("records") == [
+        {"Name": "A", "Paid": 30.0, "Owes": 10.0, "Net Balance": 20.0},
+        {"Name": "B", "Paid": 0, "Owes": 10.0, "Net Balance": -10.0},
+        {"Name": "C", "Paid": 0, "Owes": 10.0, "Net Balance": -10.0},
+    ]
+
+
+def test_build_summary_cancelled_after_settlement_loop(monkeypatch):
+    cancel_event = threading.Event()
+    calculate = settlements.calculate_settlements
+
+    def cancel_when_done(receipts, event):
+        result = calculate(receipts, event)
+        cancel_event.set()
+        return result
+
+    monkeypatch.setattr(settlements, "calculate_settlements", cancel_when_done)
+    with pytest.raises(SummaryCancelled):
+        build_summary(ledger_snapshot([receipt("A", [("x", 1.0, ["B"])])]), cancel_event)